@@ -7,12 +7,24 @@ so there is ARNodeApiClientMixin to allow querying nodes without boilerplate
 to set the correct port and scheme.
 """
 import copy
+import functools
+import heapq
+import io
 import logging
 import os
-from typing import List, Optional
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, List, Optional
 
 import requests
 import retrying
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from dcos_test_utils import (
     diagnostics,
@@ -24,6 +36,117 @@ from dcos_test_utils import (
 
 log = logging.getLogger(__name__)
 
+# Seconds for which a fetched Mesos agent state is reused for sandbox lookups
+AGENT_STATE_TTL = 5
+
+
+def _split_hosts(*host_lists: Optional[str]) -> List[str]:
+    """ Concatenates comma separated host lists (e.g. read from the environment),
+    ignoring unset lists and empty entries
+    """
+    return [host for host_list in host_lists if host_list for host in host_list.split(',') if host]
+
+
+def _json(r: requests.Response):
+    """ Decodes a JSON response body, using orjson when it is installed as it is
+    considerably faster than the standard library on large payloads like agent state
+    """
+    if orjson is None:
+        return r.json()
+    return orjson.loads(r.content)
+
+
+def _memoized_client(key=None):
+    """ Decorator which turns a DcosApiSession client factory method into a property
+    that only constructs the client again when the inputs it was built from change.
+    The URL and the session auth/verify settings are always part of the cache key;
+    key can be a function of the session returning any additional inputs.
+    Every access returns a shallow copy of the cached client with its own session and URL,
+    so callers (and threads) never share cookie jars or session settings
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            cache_key = (str(self.default_url), self.session.auth, self.session.verify)
+            if key is not None:
+                cache_key += key(self)
+            cached = self._client_cache.get(method.__name__)
+            if cached is None or cached[0] != cache_key:
+                cached = (cache_key, method(self))
+                self._client_cache[method.__name__] = cached
+            client = copy.copy(cached[1])
+            client.session = _clone_session(cached[1].session)
+            client.default_url = cached[1].default_url.copy()
+            return client
+        return property(wrapper)
+    return decorator
+
+
+def _clone_session(session: requests.Session) -> requests.Session:
+    """ Creates a new session with the settings of the given session but without its cookies.
+    Only the adapters (and their connection pools) are shared with the given session
+
+    :param session: session to clone
+    :type session: requests.Session
+
+    :returns: the new session
+    :rtype: requests.Session
+    """
+    new = requests.Session()
+    new.headers.update(session.headers)
+    new.auth = copy.copy(session.auth)
+    new.hooks = {event: list(hooks) for event, hooks in session.hooks.items()}
+    new.params = copy.copy(session.params)
+    new.verify = session.verify
+    new.cert = session.cert
+    new.proxies.update(session.proxies)
+    new.stream = session.stream
+    new.trust_env = session.trust_env
+    new.max_redirects = session.max_redirects
+    for prefix, adapter in session.adapters.items():
+        new.mount(prefix, adapter)
+    return new
+
+
+def _retry_after_seconds(r: requests.Response, max_wait: int=30) -> Optional[int]:
+    """ Reads the Retry-After header (in seconds) of a response which will be retried
+
+    :param r: response that is about to be retried
+    :type r: requests.Response
+    :param max_wait: upper bound in seconds on the returned delay
+    :type max_wait: int
+
+    :returns: seconds to wait before retrying, or None if the server did not say
+    :rtype: int
+    """
+    retry_after = r.headers.get('Retry-After')
+    if retry_after is None or not retry_after.strip().isdigit():
+        return None
+    wait = min(int(retry_after), max_wait)
+    log.info('Server asked to retry after {} seconds'.format(wait))
+    return wait
+
+
+def _retry_with_backoff(**retry_kwargs):
+    """ Decorator for DcosApiSession methods which retries them like retrying.retry (retry_kwargs
+    are passed on to it), waiting with exponential backoff and jitter between attempts. If an
+    attempt sets self._retry_after to a number of seconds, that delay is used for the next wait
+    instead of the backoff
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            def wait(attempt_number, delay_since_first_attempt_ms):
+                retry_after, self._retry_after = self._retry_after, None
+                if retry_after is not None:
+                    return retry_after * 1000
+                return min(500 * 2 ** attempt_number, 30000) + random.random() * 500
+
+            self._retry_after = None
+            return retrying.Retrying(wait_func=wait, **retry_kwargs).call(method, self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class DcosUser:
     """ Representation of a DC/OS user used for authentication
@@ -36,6 +159,17 @@ class DcosUser:
         self.auth_token = None
         self.auth_cookie = None
 
+    @property
+    def auth_token(self) -> Optional[str]:
+        """ Property for the token provided at authentication time
+        """
+        return self._auth_token
+
+    @auth_token.setter
+    def auth_token(self, auth_token: Optional[str]):
+        self._auth_token = auth_token
+        self._auth_header = {'Authorization': 'token={}'.format(auth_token)}
+
     @property
     def auth_header(self) -> dict:
         """ Property for the auth header provided at authentication time
@@ -43,7 +177,7 @@ class DcosUser:
         :returns: representation of HTTP headers to use
         :rtype: dict
         """
-        return {'Authorization': 'token={}'.format(self.auth_token)}
+        return dict(self._auth_header)
 
 
 class DcosAuth(requests.auth.AuthBase):
@@ -55,8 +189,20 @@ class DcosAuth(requests.auth.AuthBase):
     def __init__(self, auth_token: str):
         self.auth_token = auth_token
 
+    @property
+    def auth_token(self) -> str:
+        """ Property for the token used to authenticate requests
+        """
+        return self._auth_token
+
+    @auth_token.setter
+    def auth_token(self, auth_token: str):
+        # The header is built once here rather than for every request
+        self._auth_token = auth_token
+        self._header = 'token={}'.format(auth_token)
+
     def __call__(self, request):
-        request.headers['Authorization'] = 'token={}'.format(self.auth_token)
+        request.headers['Authorization'] = self._header
         return request
 
 
@@ -98,6 +244,9 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
     :param auth_user: use this user's auth for all requests.
         Note: user must be authenticated explicitly or call self.wait_for_dcos()
     :type auth_user: DcosUser
+
+    The size of the HTTP connection pool shared by this session can be set with
+    the **DCOS_HTTP_POOL_SIZE** environment variable (default: 64)
     """
     def __init__(
             self,
@@ -108,11 +257,23 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             auth_user: Optional[DcosUser],
             exhibitor_admin_password: Optional[str]=None):
         super().__init__(helpers.Url.from_string(dcos_url))
+        # Many clients talk to the same Admin Router concurrently; use a pool large
+        # enough that keep-alive connections are not discarded between requests
+        pool_size = int(os.getenv('DCOS_HTTP_POOL_SIZE', '64'))
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Connection'] = 'keep-alive'
         self.master_list = masters
         self.slave_list = slaves
         self.public_slave_list = public_slaves
         self.auth_user = auth_user
         self.exhibitor_admin_password = exhibitor_admin_password
+        self._client_cache = {}
+        # Retry-After delay (in seconds) requested by the last response of a wait
+        self._retry_after = None
+        # slave ID -> (fetch time, indexed agent state)
+        self._agent_state_cache = {}
 
     @classmethod
     def create(cls):
@@ -136,6 +297,8 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         * **MASTER_HOSTS**: a complete list of the expected master IPs (optional)
         * **SLAVE_HOSTS**: a complete list of the expected private slaves IPs (optional)
         * **PUBLIC_SLAVE_HOSTS**: a complete list of the public slave IPs (optional)
+        * **WINDOWS_HOSTS**: a list of private Windows slave IPs to add to SLAVE_HOSTS (optional)
+        * **WINDOWS_PUBLIC_HOSTS**: a list of public Windows slave IPs to add to PUBLIC_SLAVE_HOSTS (optional)
 
         :returns: arguments to initialize a DcosApiSesssion
         :rtype: dict
@@ -148,70 +311,102 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             auth_user.auth_token = dcos_acs_token
 
         masters = os.getenv('MASTER_HOSTS')
-        slaves = os.getenv('SLAVE_HOSTS')
-        windows_slaves = os.getenv('WINDOWS_HOSTS')
-        public_slaves = os.getenv('PUBLIC_SLAVE_HOSTS')
-        windows_public_slaves = os.getenv('WINDOWS_PUBLIC_HOSTS')
-        if windows_slaves:
-            slaves = ",".join((slaves, windows_slaves))
-        if windows_public_slaves:
-            public_slaves = ",".join((public_slaves, windows_public_slaves))
         return {
             'auth_user': auth_user,
             'dcos_url': os.getenv('DCOS_DNS_ADDRESS', 'http://leader.mesos'),
-            'masters': masters.split(',') if masters is not None else None,
-            'slaves': slaves.split(',') if slaves is not None else [],
-            'public_slaves': public_slaves.split(',') if public_slaves is not None else []}
+            'masters': _split_hosts(masters) if masters is not None else None,
+            'slaves': _split_hosts(os.getenv('SLAVE_HOSTS'), os.getenv('WINDOWS_HOSTS')),
+            'public_slaves': _split_hosts(os.getenv('PUBLIC_SLAVE_HOSTS'), os.getenv('WINDOWS_PUBLIC_HOSTS'))}
+
+    # The node lists are sorted when they are assigned so that the node
+    # properties do not need to sort on every access
+
+    @property
+    def master_list(self) -> Optional[List[str]]:
+        """ Sorted list of master IP strings, or None if not known yet
+        """
+        return self._master_list
+
+    @master_list.setter
+    def master_list(self, masters: Optional[List[str]]):
+        self._master_list = sorted(masters) if masters is not None else None
+
+    @property
+    def slave_list(self) -> Optional[List[str]]:
+        """ Sorted list of private slave IP strings, or None if not known yet
+        """
+        return self._slave_list
+
+    @slave_list.setter
+    def slave_list(self, slaves: Optional[List[str]]):
+        self._slave_list = sorted(slaves) if slaves is not None else None
+
+    @property
+    def public_slave_list(self) -> Optional[List[str]]:
+        """ Sorted list of public slave IP strings, or None if not known yet
+        """
+        return self._public_slave_list
+
+    @public_slave_list.setter
+    def public_slave_list(self, public_slaves: Optional[List[str]]):
+        self._public_slave_list = sorted(public_slaves) if public_slaves is not None else None
 
     @property
     def masters(self) -> List[str]:
         """ Property which returns a sorted list of master IP strings for this cluster
         """
-        return sorted(self.master_list)
+        return list(self.master_list)
 
     @property
     def slaves(self) -> List[str]:
         """ Property which returns a sorted list of private slave  IP strings for this cluster
         """
-        return sorted(self.slave_list)
+        return list(self.slave_list)
 
     @property
     def public_slaves(self) -> List[str]:
         """ Property which retruns a sorted list of public slave IP strings for this cluster
         """
-        return sorted(self.public_slave_list)
+        return list(self.public_slave_list)
 
     @property
     def all_slaves(self) -> List[str]:
         """ Property which returns a sorted list of all slave IP strings for this cluster
         """
-        return sorted(self.slaves + self.public_slaves)
+        return list(heapq.merge(self.slave_list, self.public_slave_list))
 
     def set_node_lists_if_unset(self):
         """ Sets the expected cluster topology to be the observed cluster
         topology from exhibitor and mesos. I.E. if masters, slave, or
         public_slaves were not provided, accept whatever is currently available
         """
-        if self.master_list is None:
-            log.debug('Master list not provided, setting from exhibitor...')
-            r = self.get('/exhibitor/exhibitor/v1/cluster/list')
+        fetch_masters = self.master_list is None
+        fetch_slaves = self.slave_list is None or self.public_slave_list is None
+        # The exhibitor and mesos queries are independent, so issue them concurrently.
+        # Each query uses its own copy of this session as the cookie jar is not thread-safe
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if fetch_masters:
+                log.debug('Master list not provided, setting from exhibitor...')
+                masters_future = executor.submit(self.copy().get, '/exhibitor/exhibitor/v1/cluster/list')
+            if fetch_slaves:
+                slaves_future = executor.submit(self.copy().get, '/mesos/slaves')
+        if fetch_masters:
+            r = masters_future.result()
             r.raise_for_status()
-            self.master_list = sorted(r.json()['servers'])
+            self.master_list = _json(r)['servers']
             log.info('Master list set as: {}'.format(self.masters))
-        if self.slave_list is not None and self.public_slave_list is not None:
+        if not fetch_slaves:
             return
-        r = self.get('/mesos/slaves')
+        r = slaves_future.result()
         r.raise_for_status()
-        slaves_json = r.json()['slaves']
+        slaves_json = _json(r)['slaves']
         if self.slave_list is None:
             log.debug('Private slave list not provided; fetching from mesos...')
-            self.slave_list = sorted(
-                [s['hostname'] for s in slaves_json if s['attributes'].get('public_ip') != 'true'])
+            self.slave_list = [s['hostname'] for s in slaves_json if s['attributes'].get('public_ip') != 'true']
             log.info('Private slave list set as: {}'.format(self.slaves))
         if self.public_slave_list is None:
             log.debug('Public slave list not provided; fetching from mesos...')
-            self.public_slave_list = sorted(
-                [s['hostname'] for s in slaves_json if s['attributes'].get('public_ip') == 'true'])
+            self.public_slave_list = [s['hostname'] for s in slaves_json if s['attributes'].get('public_ip') == 'true']
             log.info('Public slave list set as: {}'.format(self.public_slaves))
 
     @retrying.retry(wait_fixed=5000, stop_max_delay=120 * 1000)
@@ -245,10 +440,9 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         # Set requests auth
         self.session.auth = DcosAuth(self.auth_user.auth_token)
 
-    @retrying.retry(wait_fixed=1000,
-                    stop_max_delay=5*60*1000,
-                    retry_on_result=lambda ret: ret is False,
-                    retry_on_exception=lambda x: False)
+    @_retry_with_backoff(stop_max_delay=5*60*1000,
+                         retry_on_result=lambda ret: ret is False,
+                         retry_on_exception=lambda x: False)
     def _wait_for_marathon_up(self):
         r = self.get('/marathon/v2/info')
         # http://mesosphere.github.io/marathon/api-console/index.html
@@ -259,9 +453,10 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         else:
             msg = "Waiting for Marathon, resp code is: {}"
             log.info(msg.format(r.status_code))
+            self._retry_after = _retry_after_seconds(r)
             return False
 
-    @retrying.retry(wait_fixed=1000, stop_max_delay=5*60*1000)
+    @_retry_with_backoff(stop_max_delay=5*60*1000)
     def _wait_for_zk_quorum(self):
         """Queries exhibitor to ensure all master ZKs have joined
         """
@@ -269,40 +464,40 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         if not r.ok:
             log.warning('Exhibitor status not available')
             r.raise_for_status()
-        status = r.json()
+        status = _json(r)
         log.info('Exhibitor cluster status: {}'.format(status))
         zk_nodes = sorted([n['hostname'] for n in status])
         # zk nodes will be private but masters can be public
         assert len(zk_nodes) == len(self.masters), 'ZooKeeper has not formed the expected quorum'
 
-    @retrying.retry(wait_fixed=1000,
-                    stop_max_delay=5*60*1000,
-                    retry_on_result=lambda ret: ret is False,
-                    retry_on_exception=lambda x: False)
+    @_retry_with_backoff(stop_max_delay=5*60*1000,
+                         retry_on_result=lambda ret: ret is False,
+                         retry_on_exception=lambda x: False)
     def _wait_for_slaves_to_join(self):
         r = self.get('/mesos/master/slaves')
         if r.status_code != 200:
             msg = "Mesos master returned status code {} != 200 "
             msg += "continuing to wait..."
             log.info(msg.format(r.status_code))
+            self._retry_after = _retry_after_seconds(r)
             return False
-        data = r.json()
+        data = _json(r)
         # Check that there are all the slaves the test knows about. They are all
         # needed to pass the test.
         num_slaves = len(data['slaves'])
-        if num_slaves >= len(self.all_slaves):
+        all_slaves = self.all_slaves
+        if num_slaves >= len(all_slaves):
             msg = "Sufficient ({} >= {}) number of slaves have joined the cluster"
-            log.info(msg.format(num_slaves, self.all_slaves))
+            log.info(msg.format(num_slaves, all_slaves))
             return True
         else:
             msg = "Current number of slaves: {} < {}, continuing to wait..."
-            log.info(msg.format(num_slaves, self.all_slaves))
+            log.info(msg.format(num_slaves, all_slaves))
             return False
 
-    @retrying.retry(wait_fixed=1000,
-                    stop_max_delay=5*60*1000,
-                    retry_on_result=lambda ret: ret is False,
-                    retry_on_exception=lambda x: False)
+    @_retry_with_backoff(stop_max_delay=5*60*1000,
+                         retry_on_result=lambda ret: ret is False,
+                         retry_on_exception=lambda x: False)
     def _wait_for_adminrouter_up(self):
         try:
             # Yeah, we can also put it in retry_on_exception, but
@@ -316,15 +511,20 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             log.info("Nginx is UP!")
             return True
 
+    def _wait_for_srouter_slaves_endpoints(self):
+        # Agents confirmed in an earlier poll are not probed again during this
+        # wait. A fresh set is used for every wait so that agents are checked
+        # again after e.g. a node restart.
+        self._poll_srouter_slaves_endpoints(set())
+
     # Retry if returncode is False, do not retry on exceptions.
     # We don't want to infinite retries while waiting for agent endpoints,
     # when we are retrying on both HTTP 502 and 404 statuses
-    # Added a stop_max_attempt to 60.
-    @retrying.retry(wait_fixed=2000,
-                    retry_on_result=lambda r: r is False,
-                    retry_on_exception=lambda _: False,
-                    stop_max_attempt_number=60)
-    def _wait_for_srouter_slaves_endpoints(self):
+    # Stop retrying after 2 minutes.
+    @_retry_with_backoff(retry_on_result=lambda r: r is False,
+                         retry_on_exception=lambda _: False,
+                         stop_max_delay=2*60*1000)
+    def _poll_srouter_slaves_endpoints(self, confirmed_slaves: set):
         # Get currently known agents. This request is served straight from
         # Mesos (no AdminRouter-based caching is involved).
         r = self.get('/mesos/master/slaves')
@@ -332,49 +532,67 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         # If the agent has restarted, the mesos endpoint can give 502
         # for a brief moment.
         if r.status_code == 502:
+            self._retry_after = _retry_after_seconds(r)
             return False
 
         assert r.status_code == 200
 
-        data = r.json()
+        data = _json(r)
         # only check against the slaves we expect to be in the cluster
         # so we can check that cluster has returned after a failure
         # in which case will will have new slaves and dead slaves
-        slaves_ids = sorted(x['id'] for x in data['slaves'] if x['hostname'] in self.all_slaves)
-
-        for slave_id in slaves_ids:
-            in_progress_status_codes = (
-                # AdminRouter's slave endpoint internally uses cached Mesos
-                # state data. That is, slave IDs of just recently joined
-                # slaves can be unknown here. For those, this endpoint
-                # returns a 404. Retry in this case, until this endpoint
-                # is confirmed to work for all known agents.
-                404,
-                # During a node restart or a DC/OS upgrade, this
-                # endpoint returns a 502 temporarily, until the agent has
-                # started up and the Mesos agent HTTP server can be reached.
-                502,
-                # We have seen this endpoint return 503 with body
-                # b'Agent has not finished recovery' on a cluster which
-                # later became healthy.
-                503,
-            )
-            uri = '/slave/{}/slave%281%29/state'.format(slave_id)
-            r = self.get(uri)
+        all_slaves = set(self.all_slaves)
+        slaves_ids = sorted(x['id'] for x in data['slaves'] if x['hostname'] in all_slaves)
+        slaves_ids = [slave_id for slave_id in slaves_ids if slave_id not in confirmed_slaves]
+        if not slaves_ids:
+            return
+
+        # The per-agent requests are independent; fan them out over the shared
+        # connection pool so that a poll costs roughly one round trip instead of one
+        # per agent. Each request uses its own copy of this session as the cookie jar
+        # is not thread-safe
+        uris = ['/slave/{}/slave%281%29/state'.format(slave_id) for slave_id in slaves_ids]
+        sessions = [self.copy() for _ in uris]
+        with ThreadPoolExecutor(max_workers=min(32, len(uris))) as executor:
+            responses = list(executor.map(lambda session, uri: session.get(uri), sessions, uris))
+
+        in_progress_status_codes = (
+            # AdminRouter's slave endpoint internally uses cached Mesos
+            # state data. That is, slave IDs of just recently joined
+            # slaves can be unknown here. For those, this endpoint
+            # returns a 404. Retry in this case, until this endpoint
+            # is confirmed to work for all known agents.
+            404,
+            # During a node restart or a DC/OS upgrade, this
+            # endpoint returns a 502 temporarily, until the agent has
+            # started up and the Mesos agent HTTP server can be reached.
+            502,
+            # We have seen this endpoint return 503 with body
+            # b'Agent has not finished recovery' on a cluster which
+            # later became healthy.
+            503,
+        )
+        in_progress_response = None
+        for slave_id, uri, r in zip(slaves_ids, uris, responses):
             if r.status_code in in_progress_status_codes:
-                return False
+                in_progress_response = r
+                continue
             assert r.status_code == 200, (
                 'Expecting status code 200 for GET request to {uri} but got '
                 '{status_code} with body {content}'
             ).format(uri=uri, status_code=r.status_code, content=r.content)
-            data = r.json()
+            data = _json(r)
             assert "id" in data
             assert data["id"] == slave_id
+            confirmed_slaves.add(slave_id)
 
-    @retrying.retry(wait_fixed=2000,
-                    stop_max_delay=5*60*1000,
-                    retry_on_result=lambda r: r is False,
-                    retry_on_exception=lambda _: False)
+        if in_progress_response is not None:
+            self._retry_after = _retry_after_seconds(in_progress_response)
+            return False
+
+    @_retry_with_backoff(stop_max_delay=5*60*1000,
+                         retry_on_result=lambda r: r is False,
+                         retry_on_exception=lambda _: False)
     def _wait_for_metronome(self):
         # Although this is named `wait_for_metronome`, some of the waiting
         # done in this function is, implicitly, for Admin Router.
@@ -396,25 +614,23 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             if error_message:
                 log.info(error_message)
             log.info('Continuing to wait for Metronome')
+            self._retry_after = _retry_after_seconds(r)
             return False
 
         assert r.status_code == 200, "Expecting status code 200 for Metronome but got {} with body {}"\
             .format(r.status_code, r.content)
 
-    @retrying.retry(wait_fixed=2000,
-                    retry_on_result=lambda r: r is False,
-                    retry_on_exception=lambda _: False)
+    @_retry_with_backoff(retry_on_result=lambda r: r is False,
+                         retry_on_exception=lambda _: False)
     def _wait_for_all_healthy_services(self):
         r = self.health.get('/units')
         r.raise_for_status()
 
-        all_healthy = True
-        for unit in r.json()['units']:
-            if unit['health'] != 0:
-                log.info("{} service health: {}".format(unit['id'], unit['health']))
-                all_healthy = False
+        unhealthy_units = [unit for unit in _json(r)['units'] if unit['health'] != 0]
+        for unit in unhealthy_units:
+            log.info("{} service health: {}".format(unit['id'], unit['health']))
 
-        return all_healthy
+        return not unhealthy_units
 
     def wait_for_dcos(self):
         """ This method will wait for:
@@ -438,18 +654,37 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
                 'Alternatively, set WAIT_FOR_HOSTS=false in the environment to use whichever hosts '
                 'are currently registered.')
         self.set_node_lists_if_unset()
-        self._wait_for_marathon_up()
-        self._wait_for_zk_quorum()
-        self._wait_for_slaves_to_join()
-        self._wait_for_srouter_slaves_endpoints()
-        self._wait_for_metronome()
+
+        def wait_for_slaves(session):
+            # The agent endpoints are only checked for agents that have joined,
+            # so all agents must have joined before checking them
+            session._wait_for_slaves_to_join()
+            session._wait_for_srouter_slaves_endpoints()
+
+        # These waits poll independent services, so run them concurrently and
+        # only wait as long as the slowest one. Each wait polls through its own
+        # copy of this session as the cookie jar is not thread-safe
+        independent_waits = [
+            lambda session: session._wait_for_marathon_up(),
+            lambda session: session._wait_for_zk_quorum(),
+            wait_for_slaves,
+            lambda session: session._wait_for_metronome()]
+        with ThreadPoolExecutor(max_workers=len(independent_waits)) as executor:
+            futures = [executor.submit(wait, self.copy()) for wait in independent_waits]
+        for future in futures:
+            future.result()
         self._wait_for_all_healthy_services()
 
     def copy(self):
         """ Create a new client session from this one without cookies, with the authentication intact.
+        The new session shares this session's connection pool so that keep-alive connections are reused.
         """
-        new = copy.deepcopy(self)
-        new.session.cookies.clear()
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new._client_cache = {}
+        new._agent_state_cache = {}
+        new.auth_user = copy.copy(self.auth_user)
+        new.session = _clone_session(self.session)
         return new
 
     def get_user_session(self, user: DcosUser):
@@ -483,10 +718,11 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             session=self.copy().session,
             exhibitor_admin_password=self.exhibitor_admin_password)
 
-    @property
+    @_memoized_client()
     def marathon(self):
         """ Property which returns a :class:`dcos_test_utils.marathon.Marathon`
-        derived from this session
+        derived from this session. The client is only rebuilt when the inputs it was built from
+        change; every access gets its own session
         """
         return marathon.Marathon(
             default_url=self.default_url.copy(path='marathon'),
@@ -501,10 +737,11 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         new.default_url = self.default_url.copy(path='service/metronome')
         return new
 
-    @property
+    @_memoized_client()
     def jobs(self):
         """ Property which returns a :class:`dcos_test_utils.jobs.Jobs`
-        derived from this session
+        derived from this session. The client is only rebuilt when the inputs it was built from
+        change; every access gets its own session
         """
         return jobs.Jobs(
                 default_url=self.default_url.copy(path='service/metronome'),
@@ -519,10 +756,11 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
             default_url=self.default_url.copy(path="package"),
             session=self.copy().session)
 
-    @property
+    @_memoized_client(key=lambda self: (tuple(self.master_list), tuple(self.slave_list), tuple(self.public_slave_list)))
     def health(self):
         """ Property which returns a :class:`dcos_test_utils.diagnostics.Diagnostics`
-        derived from this session
+        derived from this session. The client is only rebuilt when the inputs it was built from
+        change; every access gets its own session
         """
         health_url = self.default_url.copy(query='cache=0', path='system/health/v1')
         return diagnostics.Diagnostics(
@@ -592,22 +830,91 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         :returns: the directory of the sandbox
         :rtype: str
         """
-        r = self.get('/agent/{}/state'.format(slave_id))
-        r.raise_for_status()
-        agent_state = r.json()
+        agent_state = self._get_agent_state(slave_id)
+        if task_id not in agent_state.get(framework_id, {}).get('executors_by_id', {}):
+            # The cached state may predate the task, so look again with a fresh state
+            agent_state = self._get_agent_state(slave_id, refresh=True)
 
         try:
-            framework = next(f for f in agent_state['frameworks'] if f['id'] == framework_id)
-        except StopIteration:
+            framework = agent_state[framework_id]
+        except KeyError:
             raise Exception('Framework {} not found on agent {}'.format(framework_id, slave_id))
 
         try:
-            executor = next(e for e in framework['executors'] if e['id'] == task_id)
-        except StopIteration:
+            executor = framework['executors_by_id'][task_id]
+        except KeyError:
             raise Exception('Executor {} not found on framework {} on agent {}'.format(task_id, framework_id, slave_id))
 
         return executor['directory']
 
+    def _get_agent_state(self, slave_id: str, refresh: bool=False) -> dict:
+        """ Fetches the state of a Mesos agent, reusing a copy fetched less than
+        AGENT_STATE_TTL seconds ago unless refresh is set
+
+        :param slave_id: ID of the agent
+        :type slave_id: str
+        :param refresh: if True, always fetch the state from the agent
+        :type refresh: bool
+
+        :returns: the agent frameworks indexed by framework ID, with the executors
+            of each framework indexed by executor ID under 'executors_by_id'
+        :rtype: dict
+        """
+        cached = self._agent_state_cache.get(slave_id)
+        if not refresh and cached is not None and time.monotonic() - cached[0] < AGENT_STATE_TTL:
+            return cached[1]
+        r = self.get('/agent/{}/state'.format(slave_id))
+        r.raise_for_status()
+        agent_state = {
+            f['id']: {'executors_by_id': {e['id']: e for e in f['executors']}}
+            for f in _json(r)['frameworks']}
+        self._agent_state_cache[slave_id] = (time.monotonic(), agent_state)
+        return agent_state
+
+    def _stream_agent_file(self, slave_id: str, path: str, dst: IO[bytes], chunk_size: int=65536) -> Optional[str]:
+        """ Streams a file from an agent into a file-like object without buffering the whole response
+
+        :param slave_id: ID of the slave to download from
+        :type slave_id: str
+        :param path: absolute path of the file on the agent
+        :type path: str
+        :param dst: binary file-like object to write the content to
+        :type dst: IO[bytes]
+        :param chunk_size: number of bytes to read at a time
+        :type chunk_size: int
+
+        :returns: the encoding declared by the agent for the file, if any
+        :rtype: str
+        """
+        with self.get('/agent/{}/files/download'.format(slave_id), params={'path': path}, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size):
+                dst.write(chunk)
+            return r.encoding
+
+    def _download_sandbox_files(self, slave_id: str, paths: List[str]) -> List[str]:
+        """ Downloads files from an agent concurrently over the shared connection pool
+
+        :param slave_id: ID of the slave to download from
+        :type slave_id: str
+        :param paths: absolute paths of the files on the agent
+        :type paths: list
+
+        :returns: text contents of the files, in the order of paths
+        :rtype: list
+        """
+        def download(session, path):
+            buf = io.BytesIO()
+            encoding = session._stream_agent_file(slave_id, path, buf)
+            return buf.getvalue().decode(encoding or 'utf-8', errors='replace')
+
+        if len(paths) <= 1:
+            return [download(self, path) for path in paths]
+        # Each download uses its own copy of this session as the cookie jar is not thread-safe
+        sessions = [self.copy() for _ in paths]
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as executor:
+            return list(executor.map(download, sessions, paths))
+
     def mesos_sandbox_file(self, slave_id: str, framework_id: str, task_id: str, filename: str) -> str:
         """ Gets a specific file from a task sandbox and returns the text content
 
@@ -622,12 +929,55 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
 
         :returns: sandbox text contents
         """
-        r = self.get(
-            '/agent/{}/files/download'.format(slave_id),
-            params={'path': self.mesos_sandbox_directory(slave_id, framework_id, task_id) + '/' + filename}
-        )
-        r.raise_for_status()
-        return r.text
+        return self.mesos_sandbox_files(slave_id, framework_id, task_id, [filename])[filename]
+
+    def mesos_sandbox_file_stream(
+            self,
+            slave_id: str,
+            framework_id: str,
+            task_id: str,
+            filename: str,
+            dst: IO[bytes],
+            chunk_size: int=65536) -> None:
+        """ Streams a specific file from a task sandbox into a binary file-like object,
+        which avoids holding large files like logs in memory
+
+        :param slave_id: ID of the slave running the task
+        :type slave_id: str
+        :param framework_id: ID of the framework of the task
+        :type framework_id: str
+        :param task_id: ID of the task
+        :type task_id: str
+        :param filename: filename in the sandbox
+        :type filename: str
+        :param dst: binary file-like object to write the file content to
+        :type dst: IO[bytes]
+        :param chunk_size: number of bytes to read at a time
+        :type chunk_size: int
+        """
+        path = self.mesos_sandbox_directory(slave_id, framework_id, task_id) + '/' + filename
+        self._stream_agent_file(slave_id, path, dst, chunk_size=chunk_size)
+
+    def mesos_sandbox_files(self, slave_id: str, framework_id: str, task_id: str, filenames: List[str]) -> dict:
+        """ Gets several files from a task sandbox concurrently and returns their text content
+
+        :param slave_id: ID of the slave running the task
+        :type slave_id: str
+        :param framework_id: ID of the framework of the task
+        :type framework_id: str
+        :param task_id: ID of the task
+        :type task_id: str
+        :param filenames: filenames in the sandbox
+        :type filenames: list
+
+        :returns: sandbox text contents keyed by filename
+        :rtype: dict
+        """
+        if not filenames:
+            return {}
+        directory = self.mesos_sandbox_directory(slave_id, framework_id, task_id)
+        texts = self._download_sandbox_files(slave_id, [directory + '/' + filename for filename in filenames])
+        return dict(zip(filenames, texts))
 
     def mesos_pod_sandbox_directory(self, slave_id: str, framework_id: str, executor_id: str, task_id: str) -> str:
         """ Gets the mesos sandbox directory for a specific task in a pod which is currently running
@@ -668,13 +1018,43 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
 
         :returns: sandbox text contents
         """
-        r = self.get(
-            '/agent/{}/files/download'.format(slave_id),
-            params={'path': self.mesos_pod_sandbox_directory(
-                slave_id, framework_id, executor_id, task_id) + '/' + filename}
-        )
-        r.raise_for_status()
-        return r.text
+        contents = self.mesos_pod_sandbox_files(slave_id, framework_id, executor_id, [task_id], [filename])
+        return contents[task_id][filename]
+
+    def mesos_pod_sandbox_files(
+            self,
+            slave_id: str,
+            framework_id: str,
+            executor_id: str,
+            task_ids: List[str],
+            filenames: List[str]) -> dict:
+        """ Gets the same files from several tasks of a currently-running pod concurrently.
+        The agent state is only queried once for all tasks of the pod
+
+        :param slave_id: ID of the slave running the pod
+        :type slave_id: str
+        :param framework_id: ID of the framework of the pod
+        :type framework_id: str
+        :param executor_id: ID of the executor
+        :type executor_id: str
+        :param task_ids: IDs of the tasks in the pod
+        :type task_ids: list
+        :param filenames: filenames in each task sandbox
+        :type filenames: list
+
+        :returns: sandbox text contents keyed by task ID and then by filename
+        :rtype: dict
+        """
+        contents = {task_id: {} for task_id in task_ids}
+        keys = [(task_id, filename) for task_id in task_ids for filename in filenames]
+        if not keys:
+            return contents
+        executor_directory = self.mesos_sandbox_directory(slave_id, framework_id, executor_id)
+        texts = self._download_sandbox_files(
+            slave_id, ['{}/tasks/{}/{}'.format(executor_directory, task_id, filename) for task_id, filename in keys])
+        for (task_id, filename), text in zip(keys, texts):
+            contents[task_id][filename] = text
+        return contents
 
     def get_version(self) -> str:
         """ Queries the DC/OS version endpoint to get DC/OS version
@@ -683,5 +1063,5 @@ class DcosApiSession(helpers.ARNodeApiClientMixin, helpers.RetryCommonHttpErrors
         """
         version_metadata = self.get('/dcos-metadata/dcos-version.json')
         version_metadata.raise_for_status()
-        data = version_metadata.json()
+        data = _json(version_metadata)
         return data["version"]
@@ -21,6 +21,9 @@ setup(
         'responses',
         'requests',
         'retrying'],
+    extras_require={
+        # faster JSON decoding of large cluster state responses
+        'orjson': ['orjson']},
     entry_points={
         'pytest11': [
             'pytest-dcos = pytest_dcos.plugin']}
@@ -1,6 +1,10 @@
 """ Verifies basic interface for the test harness employed in
 DC/OS integration tests, see: packages/dcos-integration-tests/extra
 """
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import requests
 
@@ -20,6 +24,56 @@ class MockResponse:
         return {'token': 'bar'}
 
 
+def mock_json_response(data, status_code=200):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = data
+    response.content = json.dumps(data).encode()
+    return response
+
+
+def mock_file_response(content):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(content.encode())
+    return response
+
+
+AGENT_STATE = {'frameworks': [{'id': 'fw-1', 'executors': [
+    {'id': 'task-1', 'directory': '/sandbox/task-1'},
+    {'id': 'exec-1', 'directory': '/sandbox/exec-1'}]}]}
+
+
+class MockAgent:
+    """ Serves AGENT_STATE for agent state queries and sandbox downloads whose content
+    is the requested path, unless file_content is set
+    """
+    def __init__(self):
+        self.requests = []
+        self.file_content = None
+
+    def request(self, session, method, url, params=None, **kwargs):
+        self.requests.append({'session': session, 'url': url, 'params': params, 'kwargs': kwargs})
+        if params is None:
+            return mock_json_response(AGENT_STATE)
+        return mock_file_response(self.file_content if self.file_content is not None else params['path'])
+
+    @property
+    def downloads(self):
+        return [r for r in self.requests if r['params'] is not None]
+
+
+@pytest.fixture
+def mock_agent(monkeypatch, mock_dcos_client):
+    # depends on mock_dcos_client so that this request mock is installed after its own
+    agent = MockAgent()
+
+    def mock_request(session, *args, **kwargs):
+        return agent.request(session, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    return agent
+
+
 @pytest.fixture
 def mock_dcos_client(monkeypatch):
     monkeypatch.setenv('DCOS_DNS_ADDRESS', 'http://mydcos.dcos')
@@ -94,3 +148,328 @@ def test_api_client_session_path(monkeypatch):
     api.get(test_path)
     assert mock_request.call_args[0][0] == 'GET'
     assert mock_request.call_args[0][1] == access_url + test_path
+
+
+def test_connection_pool_size(monkeypatch, mock_dcos_client):
+    adapter = mock_dcos_client.session.get_adapter('https://mydcos.dcos')
+    assert adapter._pool_maxsize == 64
+    assert mock_dcos_client.session.get_adapter('http://mydcos.dcos') is adapter
+    monkeypatch.setenv('DCOS_HTTP_POOL_SIZE', '8')
+    args = dcos_api.DcosApiSession.get_args_from_env()
+    args['auth_user'] = None
+    cluster = dcos_api.DcosApiSession(**args)
+    assert cluster.session.get_adapter('https://mydcos.dcos')._pool_maxsize == 8
+
+
+def test_set_node_lists_if_unset(monkeypatch):
+    def mock_request(session, method, url, **kwargs):
+        if url.endswith('/exhibitor/exhibitor/v1/cluster/list'):
+            return mock_json_response({'servers': ['10.0.0.2', '10.0.0.1']})
+        return mock_json_response({'slaves': [
+            {'hostname': '10.0.1.2', 'attributes': {}},
+            {'hostname': '10.0.1.1', 'attributes': {}},
+            {'hostname': '10.0.2.1', 'attributes': {'public_ip': 'true'}}]})
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    cluster = dcos_api.DcosApiSession('http://mydcos.dcos', None, None, None, None)
+    cluster.set_node_lists_if_unset()
+    assert cluster.masters == ['10.0.0.1', '10.0.0.2']
+    assert cluster.slaves == ['10.0.1.1', '10.0.1.2']
+    assert cluster.public_slaves == ['10.0.2.1']
+
+
+def test_copy_shares_connection_pool(mock_dcos_client):
+    mock_dcos_client.session.verify = '/tmp/ca.crt'
+    mock_dcos_client.session.cookies.update({'dcos-acs-auth-cookie': 'foo'})
+    new = mock_dcos_client.copy()
+    assert new.session is not mock_dcos_client.session
+    assert new.session.get_adapter('https://mydcos.dcos') is mock_dcos_client.session.get_adapter('https://mydcos.dcos')
+    assert new.session.verify == '/tmp/ca.crt'
+    assert new.masters == mock_dcos_client.masters
+    assert len(new.session.cookies.items()) == 0
+
+
+def test_copy_keeps_session_settings(mock_dcos_client):
+    hook = MagicMock()
+    custom_adapter = requests.adapters.HTTPAdapter()
+    mock_dcos_client.session.hooks['response'].append(hook)
+    mock_dcos_client.session.params = {'foo': 'bar'}
+    mock_dcos_client.session.trust_env = False
+    mock_dcos_client.session.max_redirects = 3
+    mock_dcos_client.session.stream = True
+    mock_dcos_client.session.mount('https://mydcos.dcos:8443', custom_adapter)
+    mock_dcos_client.auth_user = dcos_api.DcosUser({'foo': 'bar'})
+    mock_dcos_client.auth_user.auth_token = 't1'
+    mock_dcos_client.session.auth = dcos_api.DcosAuth('t1')
+    new = mock_dcos_client.copy()
+    assert new.session.hooks['response'] == [hook]
+    assert new.session.params == {'foo': 'bar'}
+    assert new.session.trust_env is False
+    assert new.session.max_redirects == 3
+    assert new.session.stream is True
+    assert new.session.get_adapter('https://mydcos.dcos:8443/foo') is custom_adapter
+    # the copy has its own auth objects
+    new.session.auth.auth_token = 't2'
+    new.auth_user.auth_token = 't2'
+    assert mock_dcos_client.session.auth.auth_token == 't1'
+    assert mock_dcos_client.auth_user.auth_token == 't1'
+    new.session.params['foo'] = 'baz'
+    new.session.hooks['response'].append(MagicMock())
+    assert mock_dcos_client.session.params == {'foo': 'bar'}
+    assert mock_dcos_client.session.hooks['response'] == [hook]
+
+
+def test_memoized_clients(mock_dcos_client):
+    def cached(name):
+        return mock_dcos_client._client_cache[name][1]
+
+    mock_dcos_client.marathon
+    marathon = cached('marathon')
+    mock_dcos_client.marathon
+    assert cached('marathon') is marathon
+    mock_dcos_client.health
+    health = cached('health')
+    # changing the inputs of a client rebuilds it
+    mock_dcos_client.session.auth = dcos_api.DcosAuth('foo')
+    assert mock_dcos_client.marathon.session.auth.auth_token == 'foo'
+    assert cached('marathon') is not marathon
+    mock_dcos_client.slave_list = ['1.1.1.1']
+    assert mock_dcos_client.health.all_slaves == mock_dcos_client.all_slaves
+    assert cached('health') is not health
+    # copies do not inherit cached clients
+    assert mock_dcos_client.get_user_session(None).marathon.session.auth is None
+
+
+def test_memoized_clients_do_not_share_sessions(mock_dcos_client):
+    first = mock_dcos_client.marathon
+    first.session.headers['Accept'] = 'text/plain'
+    first.default_url.path = 'foo'
+    second = mock_dcos_client.marathon
+    assert second.session is not first.session
+    assert second.session.headers['Accept'] != 'text/plain'
+    assert second.default_url.path == 'marathon'
+    # clients read from different threads get their own sessions sharing one connection pool
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        clients = list(executor.map(lambda _: mock_dcos_client.marathon, range(2)))
+    assert clients[0].session is not clients[1].session
+    assert clients[0].session.get_adapter('https://mydcos.dcos') is \
+        mock_dcos_client.session.get_adapter('https://mydcos.dcos')
+
+
+def test_retry_after_seconds():
+    r = requests.Response()
+    assert dcos_api._retry_after_seconds(r) is None
+    r.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert dcos_api._retry_after_seconds(r) is None
+    r.headers['Retry-After'] = '3'
+    assert dcos_api._retry_after_seconds(r) == 3
+    r.headers['Retry-After'] = '3600'
+    assert dcos_api._retry_after_seconds(r) == 30
+
+
+def test_retry_after_replaces_backoff(monkeypatch, mock_dcos_client):
+    sleeps = []
+    monkeypatch.setattr(dcos_api.retrying.time, 'sleep', sleeps.append)
+    responses = [
+        mock_json_response({}, status_code=503),
+        mock_json_response({}, status_code=503),
+        mock_json_response({})]
+    responses[0].headers = {'Retry-After': '3'}
+    responses[1].headers = {}
+    monkeypatch.setattr(requests.Session, 'request', lambda *args, **kwargs: responses.pop(0))
+    assert mock_dcos_client._wait_for_marathon_up()
+    # the Retry-After delay is used as is, then the backoff applies again
+    assert sleeps[0] == 3
+    assert 2 <= sleeps[1] <= 2.5
+
+
+def test_node_lists_sorted():
+    cluster = dcos_api.DcosApiSession(
+        'http://mydcos.dcos', ['10.0.0.2', '10.0.0.1'], ['10.0.1.3', '10.0.1.1'], ['10.0.1.2'], None)
+    assert cluster.masters == ['10.0.0.1', '10.0.0.2']
+    assert cluster.slaves == ['10.0.1.1', '10.0.1.3']
+    assert cluster.all_slaves == ['10.0.1.1', '10.0.1.2', '10.0.1.3']
+    # lists assigned after construction are sorted as well
+    cluster.slave_list = ['10.0.1.9', '10.0.1.0']
+    assert cluster.slave_list == ['10.0.1.0', '10.0.1.9']
+    assert cluster.all_slaves == ['10.0.1.0', '10.0.1.2', '10.0.1.9']
+
+
+def test_mesos_sandbox_directory(mock_dcos_client, mock_agent):
+    assert mock_dcos_client.mesos_sandbox_directory('agent-1', 'fw-1', 'task-1') == '/sandbox/task-1'
+    assert mock_dcos_client.mesos_sandbox_directory('agent-1', 'fw-1', 'task-1') == '/sandbox/task-1'
+    # the agent state is only fetched once
+    assert len(mock_agent.requests) == 1
+    # a miss refreshes the cached state before failing
+    with pytest.raises(Exception, match='Executor task-2 not found'):
+        mock_dcos_client.mesos_sandbox_directory('agent-1', 'fw-1', 'task-2')
+    assert len(mock_agent.requests) == 2
+    with pytest.raises(Exception, match='Framework fw-2 not found'):
+        mock_dcos_client.mesos_sandbox_directory('agent-1', 'fw-2', 'task-1')
+
+
+def test_mesos_sandbox_files(mock_dcos_client, mock_agent):
+    assert mock_dcos_client.mesos_sandbox_files('agent-1', 'fw-1', 'task-1', ['stdout', 'stderr']) == {
+        'stdout': '/sandbox/task-1/stdout',
+        'stderr': '/sandbox/task-1/stderr'}
+    # the concurrent downloads each go through their own session copy
+    download_sessions = [r['session'] for r in mock_agent.downloads]
+    assert mock_dcos_client.session not in download_sessions
+    assert len(set(map(id, download_sessions))) == 2
+
+
+def test_mesos_pod_sandbox_files(mock_dcos_client, mock_agent):
+    contents = mock_dcos_client.mesos_pod_sandbox_files('agent-1', 'fw-1', 'exec-1', ['t1', 't2'], ['stdout'])
+    assert contents == {
+        't1': {'stdout': '/sandbox/exec-1/tasks/t1/stdout'},
+        't2': {'stdout': '/sandbox/exec-1/tasks/t2/stdout'}}
+    # one agent state query and one download per file
+    assert len(mock_agent.requests) == 3
+    assert mock_dcos_client.mesos_pod_sandbox_file(
+        'agent-1', 'fw-1', 'exec-1', 't1', 'stderr') == '/sandbox/exec-1/tasks/t1/stderr'
+
+
+def test_auth_header():
+    user = dcos_api.DcosUser({'foo': 'bar'})
+    user.auth_token = 'bar'
+    assert user.auth_header == {'Authorization': 'token=bar'}
+    user.auth_token = 'baz'
+    assert user.auth_header == {'Authorization': 'token=baz'}
+    auth = dcos_api.DcosAuth('bar')
+    auth.auth_token = 'baz'
+    request = auth(requests.Request(headers={}))
+    assert request.headers['Authorization'] == 'token=baz'
+
+
+def test_wait_for_dcos_raises_wait_errors(monkeypatch):
+    calls = []
+    sessions = {}
+
+    def mock_wait(self, wait):
+        calls.append(wait)
+        sessions[wait] = self
+
+    for wait in ['_wait_for_adminrouter_up', '_wait_for_marathon_up', '_wait_for_slaves_to_join',
+                 '_wait_for_srouter_slaves_endpoints', '_wait_for_metronome', '_wait_for_all_healthy_services']:
+        monkeypatch.setattr(dcos_api.DcosApiSession, wait, lambda self, wait=wait: mock_wait(self, wait))
+
+    def fail(self):
+        raise AssertionError('ZooKeeper has not formed the expected quorum')
+
+    monkeypatch.setattr(dcos_api.DcosApiSession, '_wait_for_zk_quorum', fail)
+    monkeypatch.setenv('WAIT_FOR_HOSTS', 'false')
+    cluster = dcos_api.DcosApiSession('http://mydcos.dcos', ['10.0.0.1'], [], [], None)
+    with pytest.raises(AssertionError, match='ZooKeeper'):
+        cluster.wait_for_dcos()
+    # the other waits still ran to completion, but not the final health check
+    assert set(calls) == {'_wait_for_adminrouter_up', '_wait_for_marathon_up', '_wait_for_slaves_to_join',
+                          '_wait_for_srouter_slaves_endpoints', '_wait_for_metronome'}
+    assert calls.index('_wait_for_slaves_to_join') < calls.index('_wait_for_srouter_slaves_endpoints')
+    # the concurrent waits each poll through their own session copy
+    concurrent_sessions = [sessions[wait] for wait in [
+        '_wait_for_marathon_up', '_wait_for_slaves_to_join', '_wait_for_metronome']]
+    assert cluster not in concurrent_sessions
+    assert len(set(map(id, concurrent_sessions))) == 3
+    assert sessions['_wait_for_slaves_to_join'] is sessions['_wait_for_srouter_slaves_endpoints']
+
+
+def test_mesos_sandbox_file_stream(mock_dcos_client, mock_agent):
+    mock_agent.file_content = 'log line\n' * 100
+    dst = io.BytesIO()
+    mock_dcos_client.mesos_sandbox_file_stream('agent-1', 'fw-1', 'task-1', 'stdout', dst, chunk_size=16)
+    assert dst.getvalue() == b'log line\n' * 100
+    assert mock_agent.downloads[0]['kwargs']['stream']
+    assert mock_dcos_client.mesos_sandbox_file('agent-1', 'fw-1', 'task-1', 'stdout') == 'log line\n' * 100
+
+
+def test_wait_for_srouter_slaves_endpoints(monkeypatch):
+    monkeypatch.setattr(dcos_api.time, 'sleep', lambda _: None)
+    monkeypatch.setattr(dcos_api.retrying.time, 'sleep', lambda _: None)
+    urls = []
+
+    def mock_request(session, method, url, **kwargs):
+        urls.append(url)
+        if url.endswith('/mesos/master/slaves'):
+            return mock_json_response({'slaves': [
+                {'id': 'agent-1', 'hostname': '10.0.1.1'},
+                {'id': 'agent-2', 'hostname': '10.0.1.2'}]})
+        slave_id = url.split('/')[-3]
+        if slave_id == 'agent-2' and urls.count(url) == 1:
+            return mock_json_response({}, status_code=404)
+        return mock_json_response({'id': slave_id})
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    cluster = dcos_api.DcosApiSession('http://mydcos.dcos', [], ['10.0.1.1', '10.0.1.2'], [], None)
+    cluster._wait_for_srouter_slaves_endpoints()
+    # agent-1 was confirmed on the first poll and is not probed again
+    assert len([url for url in urls if '/slave/agent-1/' in url]) == 1
+    assert len([url for url in urls if '/slave/agent-2/' in url]) == 2
+
+
+def test_get_args_from_env_hosts(monkeypatch):
+    for key in ['MASTER_HOSTS', 'SLAVE_HOSTS', 'PUBLIC_SLAVE_HOSTS', 'WINDOWS_HOSTS', 'WINDOWS_PUBLIC_HOSTS']:
+        monkeypatch.delenv(key, raising=False)
+    args = dcos_api.DcosApiSession.get_args_from_env()
+    assert args['masters'] is None
+    assert args['slaves'] == []
+    assert args['public_slaves'] == []
+    monkeypatch.setenv('MASTER_HOSTS', '10.0.0.1')
+    monkeypatch.setenv('SLAVE_HOSTS', '10.0.1.1,10.0.1.2')
+    monkeypatch.setenv('WINDOWS_HOSTS', '10.0.1.3')
+    monkeypatch.setenv('WINDOWS_PUBLIC_HOSTS', '10.0.2.1')
+    args = dcos_api.DcosApiSession.get_args_from_env()
+    assert args['masters'] == ['10.0.0.1']
+    assert args['slaves'] == ['10.0.1.1', '10.0.1.2', '10.0.1.3']
+    assert args['public_slaves'] == ['10.0.2.1']
+
+
+def test_stateful_clients_not_memoized(mock_dcos_client):
+    cosmos = mock_dcos_client.cosmos
+    cosmos.session.headers['Accept'] = 'application/vnd.dcos.package.install-request+json'
+    assert mock_dcos_client.cosmos is not cosmos
+    assert mock_dcos_client.cosmos.session.headers['Accept'] != cosmos.session.headers['Accept']
+    metronome = mock_dcos_client.metronome
+    mock_dcos_client.slave_list = ['1.1.1.1']
+    assert mock_dcos_client.metronome is not metronome
+    assert mock_dcos_client.metronome.slaves == ['1.1.1.1']
+
+
+def test_concurrent_requests_use_separate_sessions(monkeypatch):
+    sessions = []
+
+    def mock_request(session, method, url, **kwargs):
+        sessions.append(session)
+        if url.endswith('/exhibitor/exhibitor/v1/cluster/list'):
+            return mock_json_response({'servers': ['10.0.0.1']})
+        if url.endswith('/mesos/slaves') or url.endswith('/mesos/master/slaves'):
+            return mock_json_response({'slaves': [
+                {'id': 'agent-1', 'hostname': '10.0.1.1', 'attributes': {}},
+                {'id': 'agent-2', 'hostname': '10.0.1.2', 'attributes': {}}]})
+        return mock_json_response({'id': url.split('/')[-3]})
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    cluster = dcos_api.DcosApiSession('http://mydcos.dcos', None, None, None, None)
+    cluster.set_node_lists_if_unset()
+    cluster._wait_for_srouter_slaves_endpoints()
+    # 2 node list queries, then the agent list and 2 agent probes
+    assert len(sessions) == 5
+    concurrent_sessions = sessions[:2] + sessions[3:]
+    assert cluster.session not in concurrent_sessions
+    assert len(set(map(id, concurrent_sessions))) == 4
+
+
+def test_json_uses_orjson_when_available(monkeypatch):
+    class StubOrjson:
+        @staticmethod
+        def loads(content):
+            assert isinstance(content, bytes)
+            return json.loads(content.decode())
+
+    monkeypatch.setattr(dcos_api, 'orjson', StubOrjson)
+    response = MagicMock(content=b'{"version": "1.11"}')
+    response.json.side_effect = AssertionError('Response.json() should not be used')
+    assert dcos_api._json(response) == {'version': '1.11'}
+    monkeypatch.setattr(dcos_api, 'orjson', None)
+    response.json.side_effect = None
+    response.json.return_value = {'version': '1.10'}
+    assert dcos_api._json(response) == {'version': '1.10'}